@@ -81,7 +81,7 @@ def is_sls_running():
 
 
 def is_zmq_running():
-    return is_process_running("moench04ZmqProcess")
+    return is_process_running("moench03ZmqProcess")
 
 
 def is_pc_ready():
@@ -105,18 +105,20 @@ def is_process_running(name):
 def kill_processes_by_name(
     name, sudo=False, root_username="root", root_password="pass"
 ):
-    try:
-        for line in os.popen("pgrep -f %s" % name):
-            pid = int(line)
-            if sudo:
-                subprocess.call(
-                    f'su - {root_username} -c "sudo kill -9 {pid}" <<< {root_password}',
-                    shell=True,
-                )
-            else:
+    # errors are raised to the caller, so the reason a teardown failed is not lost
+    for line in os.popen("pgrep -f %s" % name):
+        pid = int(line)
+        if sudo:
+            subprocess.call(
+                f'su - {root_username} -c "sudo kill -9 {pid}" <<< {root_password}',
+                shell=True,
+            )
+        else:
+            try:
                 os.kill(pid, signal.SIGKILL)
-    except:
-        print("Error occurred while killing process")
+            except ProcessLookupError:
+                # pgrep -f also matches the shell it was started from, which is gone by now
+                pass
 
 
 def start_10g_interface(root_username="root", root_password="pass"):
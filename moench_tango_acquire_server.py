@@ -47,8 +47,11 @@ class MoenchDetectorAcquire(Device):
             except:
                 control_state = DevState.OFF
             else:
-                break
-            attempts_counter += 1
+                # the control device connects to the detector in the background and reports INIT meanwhile
+                if control_state != DevState.INIT:
+                    break
+            if control_state != DevState.INIT:
+                attempts_counter += 1
             self.info_stream(f"Control device status: {control_state}")
             self.info_stream(f"Attempts left: {self.MAX_ATTEMPTS - attempts_counter}")
             time.sleep(self.CONNECT_COOLDOWN)
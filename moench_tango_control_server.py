@@ -1,14 +1,29 @@
 #!/bin/python3
 from numpy import tri
-from tango import AttrWriteType, DevState, DispLevel, GreenMode, AttrDataFormat
+from tango import (
+    AttrWriteType,
+    DevState,
+    DispLevel,
+    GreenMode,
+    AttrDataFormat,
+    CmdArgType,
+    EnsureOmniThread,
+    Util,
+)
 from tango.server import Device, attribute, command, pipe, device_property
 from slsdet import Moench, runStatus, timingMode, detectorSettings, frameDiscardPolicy
 from _slsdet import IpAddr
 import time
 import os, sys
 import re
+import threading
+import atexit
+import subprocess
+import traceback
+import concurrent.futures
 import computer_setup
 from pathlib import PosixPath
+from types import MappingProxyType
 from enum import Enum, IntEnum
 from bidict import bidict
 import asyncio
@@ -17,12 +32,43 @@ import random
 import datetime
 from skimage.io import imread
 
+_IP_RE = re.compile(r"^(\d{1,3}\.){3}\d{1,3}$")
+
 
 class MoenchDetectorControl(Device):
     _tiff_fullpath_last = ""
+    _rx_version = ""
+    _firmware_version = ""
+    # latest frames matter for the live preview, so the receiver must not buffer a long backlog
+    _rx_zmq_hwm = 8
     _last_triggers = ""
     _last_image = np.zeros([400, 400], dtype=np.int)
     green_mode = GreenMode.Asyncio
+    # lifetime of cached detector values in seconds
+    _CACHE_TTL = 0.5
+    _STATUS_TTL = 0.2
+    # snapshot stops refreshing an attribute no client has read for this many periods
+    _SNAPSHOT_IDLE_TICKS = 10
+    # lower bound for POLLING_PERIOD in ms, smaller values would busy-loop against the detector
+    _MIN_POLLING_PERIOD = 100
+    # attributes which only change on writes, clients subscribe to their change events
+    _WRITE_EVENT_ATTRIBUTES = (
+        "exposure",
+        "period",
+        "frames",
+        "triggers",
+        "settings",
+        "timing_mode",
+        "highvoltage",
+        "filename",
+        "filepath",
+        "filewrite",
+    )
+    # a single detector call in the snapshot may not stall it longer than this (s)
+    _RPC_TIMEOUT = 0.2
+    _WRITE_ATTEMPTS = 2
+    # only detector errors with these fragments (lower case) are worth retrying, rejected values are not
+    _TRANSIENT_ERRORS = ("socket", "connect", "timed out", "timeout")
 
     class FrameMode(IntEnum):
         # hence detectormode in slsdet uses strings (not enums) need to be converted to strings
@@ -68,10 +114,17 @@ class MoenchDetectorControl(Device):
     )
 
     class TimingMode(IntEnum):
-        # the values are the same as in slsdet.timingMode so no bidict table is required
+        # the values are the same as in slsdet.timingMode
         AUTO_TIMING = 0
         TRIGGER_EXPOSURE = 1
 
+    timingMode_bidict = bidict(
+        {
+            TimingMode.AUTO_TIMING: timingMode.AUTO_TIMING,
+            TimingMode.TRIGGER_EXPOSURE: timingMode.TRIGGER_EXPOSURE,
+        }
+    )
+
     class DetectorSettings(IntEnum):
         # [G1_HIGHGAIN, G1_LOWGAIN, G2_HIGHCAP_HIGHGAIN, G2_HIGHCAP_LOWGAIN, G2_LOWCAP_HIGHGAIN, G2_LOWCAP_LOWGAIN, G4_HIGHGAIN, G4_LOWGAIN]
         G1_HIGHGAIN = 0
@@ -112,6 +165,14 @@ class MoenchDetectorControl(Device):
         DISCARD_EMPTY_FRAMES = 1
         DISCARD_PARTIAL_FRAMES = 2
 
+    frameDiscardPolicy_bidict = bidict(
+        {
+            FrameDiscardPolicy.NO_DISCARD: frameDiscardPolicy.NO_DISCARD,
+            FrameDiscardPolicy.DISCARD_EMPTY_FRAMES: frameDiscardPolicy.DISCARD_EMPTY_FRAMES,
+            FrameDiscardPolicy.DISCARD_PARTIAL_FRAMES: frameDiscardPolicy.DISCARD_PARTIAL_FRAMES,
+        }
+    )
+
     SLS_RECEIVER_PORT = device_property(
         dtype="str",
         doc="port of the slsReceiver instance, must match the config",
@@ -182,6 +243,11 @@ class MoenchDetectorControl(Device):
         doc="path of all moench sls executables",
         default_value="/opt/slsDetectorPackage/build/bin/",
     )
+    POLLING_PERIOD = device_property(
+        dtype="int",
+        doc="period in ms the detector is polled for attributes clients are reading",
+        default_value=1000,
+    )
 
     exposure = attribute(
         label="exposure",
@@ -363,6 +429,15 @@ class MoenchDetectorControl(Device):
         fisallowed="isWriteAvailable",
         doc="number of frames which were successfully transferred",
     )  # need to be checked, here should be a list of ints
+    rx_missingpackets = attribute(
+        display_level=DispLevel.EXPERT,
+        label="missing packets",
+        dtype=("int",),
+        max_dim_x=16,
+        access=AttrWriteType.READ,
+        fisallowed="isWriteAvailable",
+        doc="number of missing packets per udp port in the last acquisition",
+    )
     rx_hostname = attribute(
         display_level=DispLevel.EXPERT,
         label="receiver hostname",
@@ -404,6 +479,17 @@ class MoenchDetectorControl(Device):
         fisallowed="isWriteAvailable",
         doc="enable/disable streaming via zmq",
     )  # will be further required for preview direct from stream
+    rx_zmq_hwm = attribute(
+        display_level=DispLevel.EXPERT,
+        label="zmq high water mark",
+        dtype="int",
+        min_value=-1,
+        access=AttrWriteType.READ_WRITE,
+        memorized=True,
+        hw_memorized=True,
+        fisallowed="isWriteAvailable",
+        doc="receiver zmq send high water mark [-1 for the zmq default]",
+    )
     rx_version = attribute(
         display_level=DispLevel.EXPERT,
         label="rec. version",
@@ -422,6 +508,14 @@ class MoenchDetectorControl(Device):
         doc="version of detector software",
     )
 
+    rpc_timeout_count = attribute(
+        display_level=DispLevel.EXPERT,
+        label="rpc timeouts",
+        dtype="int",
+        access=AttrWriteType.READ,
+        doc="number of detector calls in the attribute snapshot which exceeded the timeout",
+    )
+
     raw_detector_status = attribute(
         display_level=DispLevel.EXPERT,
         label="detector status",
@@ -474,12 +568,109 @@ class MoenchDetectorControl(Device):
     def init_device(self):
         Device.init_device(self)
         self.set_change_event("sum_image_last", True, False)
+        for name in self._WRITE_EVENT_ATTRIBUTES:
+            self.set_change_event(name, True, False)
         self.set_state(DevState.INIT)
         self.get_device_properties(self.get_device_class())
+        if self.POLLING_PERIOD < self._MIN_POLLING_PERIOD:
+            self.warn_stream(
+                f"POLLING_PERIOD {self.POLLING_PERIOD} ms is too small, using {self._MIN_POLLING_PERIOD} ms"
+            )
+            self.POLLING_PERIOD = self._MIN_POLLING_PERIOD
+        # attribute name -> (value, monotonic timestamp of the fetch)
+        self._cache = {}
+        # published snapshots are immutable, readers only take the current reference
+        self._snapshot = MappingProxyType({})
+        self._snapshot_gen = 0
+        self._last_client_access = {}
+        self._snapshot_lock = threading.Lock()
+        self._snapshot_stop = threading.Event()
+        self._snapshot_thread = None
+        self._rpc_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._rpc_timeout_count = 0
+        # tango calls delete_device on shutdown, the atexit hook only covers exits that skip it
+        self._torn_down = False
+        atexit.unregister(self._graceful_shutdown)
+        atexit.register(self._graceful_shutdown)
+        # the detector is unavailable until the background bring-up has connected to it
+        self.moench_device = None
+        # set by delete_device, e.g. when the Init command supersedes a running bring-up
+        self._bring_up_cancel = threading.Event()
+        self._bring_up_thread = threading.Thread(
+            target=self._async_bring_up,
+            args=(self._bring_up_cancel, self._snapshot_stop),
+            daemon=True,
+        )
+        self._bring_up_thread.start()
+
+    def _async_bring_up(self, cancel, snapshot_stop):
+        # tango calls (set_state, writes, change events) from a python thread need an omni thread
+        with EnsureOmniThread():
+            try:
+                if not self._try_bring_up(cancel):
+                    return
+                self._snapshot_thread = threading.Thread(
+                    target=self._snapshot_loop, args=(snapshot_stop,), daemon=True
+                )
+                self._snapshot_thread.start()
+                self._apply_rx_zmq_hwm()
+                # clients may acquire as soon as the state is ON, so memorized settings come first
+                self._restore_memorized()
+                self.set_state(DevState.ON)
+            except Exception:
+                # otherwise the thread would die silently and leave the device in INIT forever
+                self.error_stream(traceback.format_exc())
+                self.moench_device = None
+                self.set_state(DevState.FAULT)
+                self.delete_device()
+
+    def _apply_rx_zmq_hwm(self):
+        # preview tuning only, a receiver without hwm support still gets connected
+        try:
+            self.moench_device.rx_zmqhwm = self._rx_zmq_hwm
+        except (RuntimeError, AttributeError) as e:
+            self.error_stream(f"unable to set rx_zmqhwm={self._rx_zmq_hwm}: {e}")
+
+    def _try_bring_up(self, cancel, attempts=3):
+        # ports of a previous instance may not be released yet, so transient failures are retried
+        for attempt in range(attempts):
+            if cancel.is_set():
+                return False
+            try:
+                self._init_pc(cancel)
+                if cancel.is_set():
+                    return False
+                device = Moench()
+                # versions do not change while the server is running, reading them also probes the connection
+                self._firmware_version = device.firmwareversion
+                self._rx_version = device.rx_version
+                if cancel.is_set():
+                    return False
+                self.moench_device = device
+                self.info_stream(
+                    "Connected to detector (firmware %s, receiver %s)"
+                    % (self._firmware_version, self._rx_version)
+                )
+                return True
+            except (RuntimeError, OSError) as e:
+                self.info_stream(
+                    "Bring-up attempt %d/%d failed\n%s" % (attempt + 1, attempts, e)
+                )
+                if attempt < attempts - 1 and cancel.wait(
+                    0.1 * 2**attempt * (1 + random.random())
+                ):
+                    return False
+        self.set_state(DevState.FAULT)
+        self.info_stream("Unable to establish connection with detector")
+        self.delete_device()
+        return False
+
+    def _init_pc(self, cancel):
         MAX_ATTEMPTS = 5
         self.attempts_counter = 0
         computer_setup.kill_all_pc_processes(self.ROOT_USERNAME, self.ROOT_PASSWORD)
-        time.sleep(3)
+        if cancel.wait(3):
+            return
         computer_setup.init_pc(
             virtual=self.IS_VIRTUAL_DETECTOR,
             SLS_RECEIVER_PORT=self.SLS_RECEIVER_PORT,
@@ -495,72 +686,227 @@ class MoenchDetectorControl(Device):
             ROOT_PASSWORD=self.ROOT_PASSWORD,
         )
         while not computer_setup.is_pc_ready() and self.attempts_counter < MAX_ATTEMPTS:
-            time.sleep(0.5)
+            if cancel.wait(0.5):
+                return
             self.attempts_counter += 1
-        if not computer_setup.is_pc_ready:
-            self.delete_device()
-            self.info_stream("Unable to start PC")
+        if not computer_setup.is_pc_ready():
+            raise RuntimeError("Unable to start PC")
         self.info_stream("PC is ready")
-        self.moench_device = Moench()
-        try:
-            st = self.moench_device.rx_status
-            self.info_stream("Current device status: %s" % st)
-            self.set_state(DevState.ON)
-        except RuntimeError as e:
-            self.set_state(DevState.FAULT)
-            self.info_stream("Unable to establish connection with detector\n%s" % e)
-            self.delete_device()
+
+    def _parse_memorized(self, data_type, raw):
+        if data_type == CmdArgType.DevBoolean:
+            return raw.lower() in ("1", "true")
+        if data_type in (CmdArgType.DevDouble, CmdArgType.DevFloat):
+            return float(raw)
+        if data_type == CmdArgType.DevString:
+            return raw
+        return int(raw)
+
+    def _restore_memorized(self):
+        # tango replays memorized values right after init_device, when the detector is not connected yet
+        if not Util.instance().use_db():
+            return
+        attrs = {
+            attr.get_name(): attr
+            for attr in self.get_device_attr().get_attribute_list()
+        }
+        db = Util.instance().get_database()
+        props = db.get_device_attribute_property(self.get_name(), list(attrs))
+        for name, attr_props in props.items():
+            if "__value" not in attr_props:
+                continue
+            raw = attr_props["__value"][0]
+            try:
+                value = self._parse_memorized(attrs[name].get_data_type(), raw)
+                getattr(self, f"write_{name}")(value)
+            except (ValueError, KeyError, RuntimeError) as e:
+                self.error_stream(f"unable to restore memorized {name}={raw}: {e}")
+
+    def _read_status(self):
+        return self._cached(
+            "status", self._STATUS_TTL, lambda: self.moench_device.status
+        )
 
     def isWriteAvailable(self, value):
+        if self.moench_device is None:
+            return False
         # slsdet.runStatus.IDLE, ERROR, WAITING, RUN_FINISHED, TRANSMITTING, RUNNING, STOPPED
-        if self.moench_device.status in (
+        return self._read_status() in (
             runStatus.IDLE,
             runStatus.WAITING,
             runStatus.STOPPED,
-        ):
-            return True
-        return False
+        )
+
+    def _cached(self, name, ttl, fetch):
+        # collapses repeated reads of the same attribute into a single detector call per ttl window
+        # value and timestamp live in one entry, so a concurrent _invalidate can't split them
+        now = time.monotonic()
+        entry = self._cache.get(name)
+        if entry is not None and now - entry[1] < ttl:
+            return entry[0]
+        value = fetch()
+        self._cache[name] = (value, now)
+        return value
+
+    def _invalidate(self, name):
+        self._cache.pop(name, None)
+        with self._snapshot_lock:
+            # a snapshot captured before this write must not be published afterwards
+            self._snapshot_gen += 1
+            if name in self._snapshot:
+                self._snapshot = MappingProxyType(
+                    {key: value for key, value in self._snapshot.items() if key != name}
+                )
+
+    def _read_snapshot(self, name, fetch):
+        # the lock only orders producer and writers, rebinding the reference is atomic
+        self._last_client_access[name] = time.monotonic()
+        snapshot = self._snapshot
+        if name in snapshot:
+            return snapshot[name]
+        return self._cached(name, self._CACHE_TTL, fetch)
+
+    def _snapshot_loop(self, stop):
+        # fetches the frequently polled attributes in one pass, so reads are served without rpc
+        fetchers = {
+            "exposure": lambda d: d.exptime,
+            "period": lambda d: d.period,
+            "frames": lambda d: d.frames,
+            "triggers": lambda d: d.triggers,
+            "settings": lambda d: d.settings,
+            "highvoltage": lambda d: d.highvoltage,
+            "filewrite": lambda d: d.fwrite,
+            "rx_status": lambda d: str(d.rx_status),
+            "rx_missingpackets": lambda d: d.rx_missingpackets,
+        }
+        period = self.POLLING_PERIOD / 2000
+        # fields whose last fetch failed, their error is only logged once
+        failing = set()
+        # call which exceeded the timeout and still occupies the single executor worker
+        stalled = None
+        while not stop.wait(period):
+            # attributes nobody reads are not polled, a later read refetches them once
+            active_since = time.monotonic() - self._SNAPSHOT_IDLE_TICKS * period
+            last_access = self._last_client_access
+            previous = self._snapshot
+            d = self.moench_device
+            with self._snapshot_lock:
+                gen = self._snapshot_gen
+            snapshot = {}
+            for name, fetch in fetchers.items():
+                if last_access.get(name, 0) <= active_since:
+                    continue
+                if stalled is not None and not stalled.done():
+                    # calls submitted now would queue behind the stalled one, keep the last known values
+                    if name in previous:
+                        snapshot[name] = previous[name]
+                    continue
+                if stop.is_set():
+                    # _stop_snapshot shuts the executor down, new submits would raise
+                    return
+                try:
+                    future = self._rpc_executor.submit(fetch, d)
+                    snapshot[name] = future.result(timeout=self._RPC_TIMEOUT)
+                    failing.discard(name)
+                    continue
+                except concurrent.futures.TimeoutError:
+                    # a stalled call keeps the last known value instead of blocking all reads
+                    future.cancel()
+                    stalled = future
+                    self._rpc_timeout_count += 1
+                except Exception as e:
+                    # e.g. a field the virtual detector doesn't support, the other fields are still published
+                    if name not in failing:
+                        failing.add(name)
+                        self.error_stream(f"unable to update {name} in snapshot: {e}")
+                if name in previous:
+                    snapshot[name] = previous[name]
+            with self._snapshot_lock:
+                if gen == self._snapshot_gen:
+                    self._snapshot = MappingProxyType(snapshot)
+
+    def _set_with_retry(self, name, value):
+        for attempt in range(self._WRITE_ATTEMPTS):
+            try:
+                setattr(self.moench_device, name, value)
+                return
+            except RuntimeError as e:
+                transient = any(
+                    fragment in str(e).lower() for fragment in self._TRANSIENT_ERRORS
+                )
+                if not transient or attempt == self._WRITE_ATTEMPTS - 1:
+                    raise
+                time.sleep(0.1 * 2**attempt)
 
     def read_exposure(self):
-        return self.moench_device.exptime
+        return self._read_snapshot("exposure", lambda: self.moench_device.exptime)
 
     def write_exposure(self, value):
-        self.moench_device.exptime = value
+        self._set_with_retry("exptime", value)
+        self._invalidate("exposure")
+        self.push_change_event("exposure", value)
 
     def read_delay(self):
-        return self.moench_device.delay
+        return self._cached("delay", self._CACHE_TTL, lambda: self.moench_device.delay)
 
     def write_delay(self, value):
         self.moench_device.delay = value
+        self._invalidate("delay")
 
     def read_fileindex(self):
-        return self.moench_device.findex
+        return self._cached(
+            "fileindex", self._CACHE_TTL, lambda: self.moench_device.findex
+        )
 
     def write_fileindex(self, value):
         self.moench_device.findex = value
+        self._invalidate("fileindex")
 
     def read_timing_mode(self):
-        return self.TimingMode(self.moench_device.timing.value)
+        timing = self._cached(
+            "timing_mode", self._CACHE_TTL, lambda: self.moench_device.timing
+        )
+        try:
+            return self.timingMode_bidict.inverse[timing]
+        except KeyError:
+            # e.g. gated modes set outside of tango have no TimingMode member
+            self.error_stream(f"unsupported timing mode {timing}")
+            raise
 
     def write_timing_mode(self, value):
-        self.moench_device.timing = timingMode(value)
+        self.moench_device.timing = self.timingMode_bidict[value]
+        self._invalidate("timing_mode")
+        self.push_change_event("timing_mode", value)
 
     def read_triggers(self):
-        return self.moench_device.triggers
+        return self._read_snapshot("triggers", lambda: self.moench_device.triggers)
 
     def write_triggers(self, value):
         self.moench_device.triggers = value
+        self._invalidate("triggers")
+        self.push_change_event("triggers", value)
 
     def read_filename(self):
-        return self.moench_device.fname
+        return self._cached(
+            "filename", self._CACHE_TTL, lambda: self.moench_device.fname
+        )
 
     def write_filename(self, value):
+        if self.read_filename() == value:
+            return
         self.moench_device.fname = value
+        self._invalidate("filename")
+        self.push_change_event("filename", value)
 
     def read_filepath(self):
-        return str(self.moench_device.fpath)
+        return self._cached(
+            "filepath", self._CACHE_TTL, lambda: str(self.moench_device.fpath)
+        )
 
     def write_filepath(self, value):
+        if not value:
+            self.error_stream("not valid filepath")
+            return
         if not os.path.isdir(value):
             try:
                 os.makedirs(value)
@@ -568,36 +914,47 @@ class MoenchDetectorControl(Device):
                 self.error_stream(f"no permission to create a directory in {value}")
             except OSError:
                 self.error_stream(f"os error while creating a dir in {value}")
-        if os.path.exists(value) & os.path.isdir(value):
-            try:
-                self.moench_device.fpath = value
-            except:
-                self.error_stream("not valid filepath")
+        # the directory is recreated above even if the detector already points to it,
+        # memorized values replayed on startup usually match and skip the rpc
+        # read_filepath goes through PosixPath, which drops a trailing slash
+        if os.path.isdir(value) and self.read_filepath() != os.path.normpath(value):
+            self.moench_device.fpath = value
+            self._invalidate("filepath")
+            self.push_change_event("filepath", value)
 
     def read_frames(self):
-        return self.moench_device.frames
+        return self._read_snapshot("frames", lambda: self.moench_device.frames)
 
     def write_frames(self, value):
         self.moench_device.frames = value
+        self._invalidate("frames")
+        self.push_change_event("frames", value)
 
     def read_framemode(self):
         try:
             framemode = self.frameMode_bidict.inverse[
-                self.moench_device.rx_jsonpara["frameMode"]
+                self._cached(
+                    "framemode",
+                    self._CACHE_TTL,
+                    lambda: self.moench_device.rx_jsonpara["frameMode"],
+                )
             ]
         except:
             framemode = self.FrameMode.NO_FRAME_MODE
         return framemode
 
     def write_framemode(self, value):
-        self.moench_device.rx_jsonpara["frameMode"] = self.frameMode_bidict[
-            self.FrameMode(value)
-        ]
+        self.moench_device.rx_jsonpara["frameMode"] = self.frameMode_bidict[value]
+        self._invalidate("framemode")
 
     def read_detectormode(self):
         try:
             detectormode = self.detectorMode_bidict.inverse[
-                self.moench_device.rx_jsonpara["detectorMode"]
+                self._cached(
+                    "detectormode",
+                    self._CACHE_TTL,
+                    lambda: self.moench_device.rx_jsonpara["detectorMode"],
+                )
             ]
         except:
             detectormode = self.DetectorMode.NO_DETECTOR_MODE
@@ -605,98 +962,151 @@ class MoenchDetectorControl(Device):
         return detectormode
 
     def write_detectormode(self, value):
-        self.moench_device.rx_jsonpara["detectorMode"] = self.detectorMode_bidict[
-            self.DetectorMode(value)
-        ]
+        self.moench_device.rx_jsonpara["detectorMode"] = self.detectorMode_bidict[value]
+        self._invalidate("detectormode")
 
     def read_filewrite(self):
-        return self.moench_device.fwrite
+        return self._read_snapshot("filewrite", lambda: self.moench_device.fwrite)
 
     def write_filewrite(self, value):
         self.moench_device.fwrite = value
+        self._invalidate("filewrite")
+        self.push_change_event("filewrite", value)
 
     def read_highvoltage(self):
-        return self.moench_device.highvoltage
+        return self._read_snapshot(
+            "highvoltage", lambda: self.moench_device.highvoltage
+        )
 
     def write_highvoltage(self, value):
-        try:
-            self.moench_device.highvoltage = value
-        except RuntimeError:
-            self.error_stream("not allowed highvoltage")
+        # the range is enforced by tango via min_value/max_value before this call
+        self._set_with_retry("highvoltage", value)
+        self._invalidate("highvoltage")
+        self.push_change_event("highvoltage", value)
 
     def read_period(self):
-        return self.moench_device.period
+        return self._read_snapshot("period", lambda: self.moench_device.period)
 
     def write_period(self, value):
         self.moench_device.period = value
+        self._invalidate("period")
+        self.push_change_event("period", value)
 
     def read_samples(self):
-        return self.moench_device.samples
+        return self._cached(
+            "samples", self._CACHE_TTL, lambda: self.moench_device.samples
+        )
 
     def write_samples(self, value):
         self.moench_device.samples = value
+        self._invalidate("samples")
 
     def read_settings(self):
-        return self.detectorSettings_bidict.inverse[self.moench_device.settings]
+        return self.detectorSettings_bidict.inverse[
+            self._read_snapshot("settings", lambda: self.moench_device.settings)
+        ]
 
     def write_settings(self, value):
-        self.moench_device.settings = self.detectorSettings_bidict[
-            self.DetectorSettings(value)
-        ]
+        # IntEnum keys hash like plain ints, so the raw tango value is used directly
+        self.moench_device.settings = self.detectorSettings_bidict[value]
+        self._invalidate("settings")
+        self.push_change_event("settings", value)
 
     def read_zmqip(self):
-        return str(self.moench_device.rx_zmqip)
+        return self._cached(
+            "zmqip", self._CACHE_TTL, lambda: str(self.moench_device.rx_zmqip)
+        )
 
     def write_zmqip(self, value):
-        if bool(re.match(r"^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}$", value)):
+        if self.read_zmqip() == value:
+            return
+        if _IP_RE.match(value) and all(int(octet) <= 255 for octet in value.split(".")):
             self.moench_device.rx_zmqip = IpAddr(value)
+            self._invalidate("zmqip")
         else:
             self.error_stream("not valid ip address")
 
     def read_zmqport(self):
-        return self.moench_device.rx_zmqport
+        return self._cached(
+            "zmqport", self._CACHE_TTL, lambda: self.moench_device.rx_zmqport
+        )
 
     def write_zmqport(self, value):
+        if self.read_zmqport() == value:
+            return
         self.moench_device.rx_zmqport = value
+        self._invalidate("zmqport")
 
     def read_rx_discardpolicy(self):
-        return self.FrameDiscardPolicy(self.moench_device.rx_discardpolicy.value)
+        policy = self._cached(
+            "rx_discardpolicy",
+            self._CACHE_TTL,
+            lambda: self.moench_device.rx_discardpolicy,
+        )
+        return self.frameDiscardPolicy_bidict.inverse[policy]
 
     def write_rx_discardpolicy(self, value):
-        self.moench_device.rx_discardpolicy = frameDiscardPolicy(value)
+        self.moench_device.rx_discardpolicy = self.frameDiscardPolicy_bidict[value]
+        self._invalidate("rx_discardpolicy")
 
     def read_rx_framescaught(self):
-        return self.moench_device.rx_framescaught
+        return self._cached(
+            "rx_framescaught",
+            self._CACHE_TTL,
+            lambda: self.moench_device.rx_framescaught,
+        )
 
     def write_rx_framescaught(self, value):
         pass
 
+    def read_rx_missingpackets(self):
+        # returned as a list of ints, no string conversion on the polling path
+        return self._read_snapshot(
+            "rx_missingpackets", lambda: self.moench_device.rx_missingpackets
+        )
+
     def read_rx_hostname(self):
-        return self.moench_device.rx_hostname
+        return self._cached(
+            "rx_hostname", self._CACHE_TTL, lambda: self.moench_device.rx_hostname
+        )
 
     def write_rx_hostname(self, value):
+        if self.read_rx_hostname() == value:
+            return
         self.moench_device.rx_hostname = value
+        self._invalidate("rx_hostname")
 
     def read_rx_tcpport(self):
-        return self.moench_device.rx_tcpport
+        return self._cached(
+            "rx_tcpport", self._CACHE_TTL, lambda: self.moench_device.rx_tcpport
+        )
 
     def write_rx_tcpport(self, value):
+        if self.read_rx_tcpport() == value:
+            return
         self.moench_device.rx_tcpport = value
+        self._invalidate("rx_tcpport")
 
     def read_rx_status(self):
-        return str(self.moench_device.rx_status)
+        return self._read_snapshot(
+            "rx_status", lambda: str(self.moench_device.rx_status)
+        )
 
     def write_rx_status(self, value):
         pass
 
     def read_detector_status(self):
-        tango_state = self.status_dict.get(self.moench_device.status)
+        if self.moench_device is None:
+            return DevState.INIT
+        tango_state = self.status_dict.get(self._read_status())
         return tango_state
 
     def write_detector_status(self, value):
         pass
 
     def read_receiver_status(self):
+        if self.moench_device is None:
+            return DevState.INIT
         tango_state = self.status_dict.get(self.moench_device.getReceiverStatus()[0])
         return tango_state
 
@@ -704,23 +1114,39 @@ class MoenchDetectorControl(Device):
         pass
 
     def read_rx_zmqstream(self):
-        return self.moench_device.rx_zmqstream
+        return self._cached(
+            "rx_zmqstream", self._CACHE_TTL, lambda: self.moench_device.rx_zmqstream
+        )
 
     def write_rx_zmqstream(self, value):
         self.moench_device.rx_zmqstream = value
+        self._invalidate("rx_zmqstream")
+
+    def read_rx_zmq_hwm(self):
+        return self._cached(
+            "rx_zmq_hwm", self._CACHE_TTL, lambda: self.moench_device.rx_zmqhwm
+        )
+
+    def write_rx_zmq_hwm(self, value):
+        self.moench_device.rx_zmqhwm = value
+        self._rx_zmq_hwm = value
+        self._invalidate("rx_zmq_hwm")
 
     def read_rx_version(self):
-        return self.moench_device.rx_version
+        return self._rx_version
 
     def write_rx_version(self, value):
         pass
 
     def read_firmware_version(self):
-        return self.moench_device.firmwareversion
+        return self._firmware_version
 
     def write_firmware_version(self, value):
         pass
 
+    def read_rpc_timeout_count(self):
+        return self._rpc_timeout_count
+
     def read_tiff_fullpath_next(self):
         # [filename]_d0_f[sub_file_index]_[acquisition/file_index].raw"
         savepath = self.read_filepath()
@@ -767,7 +1193,9 @@ class MoenchDetectorControl(Device):
         pass
 
     def read_raw_detector_status(self):
-        return str(self.moench_device.status)
+        if self.moench_device is None:
+            return ""
+        return str(self._read_status())
 
     def write_raw_detector_status(self):
         pass
@@ -778,11 +1206,39 @@ class MoenchDetectorControl(Device):
     def write_sum_image_last(self, value):
         pass
 
+    def _stop_snapshot(self):
+        self._snapshot_stop.set()
+        thread = self._snapshot_thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout=self.POLLING_PERIOD / 1000)
+        self._rpc_executor.shutdown(wait=False)
+
+    def _teardown_pc(self):
+        self._torn_down = True
+        self._bring_up_cancel.set()
+        self._stop_snapshot()
+        computer_setup.deactivate_pc(self.ROOT_USERNAME, self.ROOT_PASSWORD)
+
+    def _graceful_shutdown(self):
+        # the tango device may already be destroyed here, so no logging streams are used
+        if self._torn_down:
+            return
+        try:
+            self._teardown_pc()
+        except (OSError, ValueError, subprocess.SubprocessError):
+            pass
+
     def delete_device(self):
+        self._bring_up_cancel.set()
+        thread = self._bring_up_thread
+        if thread is not threading.current_thread():
+            # init_pc itself can't be interrupted, so this waits until the current step is done
+            thread.join()
         try:
-            computer_setup.deactivate_pc(self.ROOT_USERNAME, self.ROOT_PASSWORD)
+            self._teardown_pc()
             self.info_stream("SlsReceiver or zmq socket processes were killed.")
-        except Exception:
+        except (OSError, ValueError, subprocess.SubprocessError):
+            self.error_stream(traceback.format_exc())
             self.info_stream(
                 "Unable to kill slsReceiver or zmq socket. Please kill it manually."
             )
@@ -792,6 +1248,7 @@ class MoenchDetectorControl(Device):
         self.info_stream("start receiver")
         self.moench_device.startDetector()
         self.info_stream("start detector")
+        self._invalidate("status")
         # in case detector is stopped we want to leave this section earlier
         # time.sleep(exptime * frames)
         """
@@ -842,6 +1299,12 @@ class MoenchDetectorControl(Device):
     def test_push_sum_img_event(self):
         self.push_change_event("sum_image_last", self.read_sum_image_last(), 400, 400)
 
+    def is_start_acquire_allowed(self):
+        return self.moench_device is not None
+
+    def is_stop_acquire_allowed(self):
+        return self.moench_device is not None
+
     @command
     def stop_acquire(self):
         self.moench_device.stop()